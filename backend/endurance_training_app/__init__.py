@@ -1,5 +1,17 @@
 from endurance_training_app.airnow import get_aqi_data
+from endurance_training_app.deadline_utils import (
+    DeadlineExceededError,
+    UpstreamError,
+    get_deadline,
+)
 from endurance_training_app.purpleair import get_purpleair_data
 from endurance_training_app.tipping_point import calculate_tipping_point
 
-__all__ = ["calculate_tipping_point", "get_aqi_data", "get_purpleair_data"]
+__all__ = [
+    "DeadlineExceededError",
+    "UpstreamError",
+    "calculate_tipping_point",
+    "get_aqi_data",
+    "get_deadline",
+    "get_purpleair_data",
+]
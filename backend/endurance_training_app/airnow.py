@@ -9,12 +9,17 @@ import os
 from datetime import datetime, timedelta
 from typing import Any, Dict, Optional
 
-import requests
+from endurance_training_app.deadline_utils import UpstreamError, get_with_deadline
 from endurance_training_app.display_utils import get_color_from_aqi
 from endurance_training_app.location_utils import get_location_from_ip
 
+# can be overridden with the AIRNOW_API_URL environment variable (e.g., for load testing)
+AIRNOW_API_URL = "https://www.airnowapi.org"
 
-def get_aqi_data(lat: Optional[float] = None, lon: Optional[float] = None) -> Dict[str, Any]:
+
+def get_aqi_data(
+    lat: Optional[float] = None, lon: Optional[float] = None, deadline: Optional[float] = None
+) -> Dict[str, Any]:
     """
     Get AQI data from the AirNow API.
 
@@ -24,27 +29,37 @@ def get_aqi_data(lat: Optional[float] = None, lon: Optional[float] = None) -> Di
         latitude in degrees
     lon: float
         longitude in degrees
+    deadline: float
+        deadline on the time.monotonic() clock for all requests to finish by
 
     Returns
     -------
     Dict[str, Any]
         The AQI data from the AirNow API.
+
+    Raises
+    ------
+    UpstreamError
+        If the deadline passes first (DeadlineExceededError) or a call fails.
     """
     # get AirNow API key
     api_key = os.environ.get("AIRNOW_API_KEY")
 
     if lat is None or lon is None:
         # get the latitude and longitude from IP address
-        ip_data = get_location_from_ip()
+        ip_data = get_location_from_ip(deadline=deadline)
         lat, lon = ip_data["loc"].split(",")
 
-    url = "https://www.airnowapi.org/aq/forecast/latLong/?format=application/json&"
+    base_url = os.environ.get("AIRNOW_API_URL", AIRNOW_API_URL)
+    url = f"{base_url}/aq/forecast/latLong/?format=application/json&"
     params = [f"latitude={lat}", f"longitude={lon}", f"API_KEY={api_key}"]
     param_string = "&".join(params)
-    response = requests.get(url + param_string)
+    response = get_with_deadline(url + param_string, deadline=deadline)
 
     # the response is a list of dictionairies by pollutant and date
     aqi_summaries = response.json()
+    if not isinstance(aqi_summaries, list):
+        raise UpstreamError(f"Unexpected response from AirNow: {aqi_summaries}")
 
     # get today's forecast. Use the pollutant with the highest AQI
     today = datetime.today().strftime("%Y-%m-%d")
@@ -0,0 +1,181 @@
+"""
+Author: Hunter R. Merrill
+
+Description: This script contains utility functions for bounding the time spent on upstream
+API calls with a per-request deadline.
+"""
+
+from threading import Lock
+from time import monotonic, sleep
+from typing import Any, List, Optional
+
+import requests
+
+
+class UpstreamError(Exception):
+    """
+    Raised when an upstream call fails (e.g., an error status or a refused connection).
+
+    Parameters
+    ----------
+    message: str
+        description of the call that failed
+    partial_result: Any
+        whatever results were finished before the failure, if any
+    missing: List
+        identifiers (e.g., sensor IDs) of the results that were not finished
+    """
+
+    def __init__(
+        self, message: str, partial_result: Any = None, missing: Optional[List[Any]] = None
+    ) -> None:
+        super().__init__(message)
+        self.partial_result = partial_result
+        self.missing = missing if missing is not None else []
+
+
+class DeadlineExceededError(UpstreamError):
+    """Raised when the request deadline passes before an upstream call has finished."""
+
+
+def get_deadline(timeout: Optional[float] = None) -> Optional[float]:
+    """
+    Get a deadline a given number of seconds from now.
+
+    Parameters
+    ----------
+    timeout: float
+        latency budget in seconds. If None, there is no deadline.
+
+    Returns
+    -------
+    float
+        The deadline on the time.monotonic() clock, or None.
+    """
+    if timeout is None:
+        return None
+    return monotonic() + timeout
+
+
+def get_remaining_time(deadline: Optional[float] = None) -> Optional[float]:
+    """
+    Get the number of seconds left before the deadline.
+
+    Parameters
+    ----------
+    deadline: float
+        deadline on the time.monotonic() clock (output of get_deadline)
+
+    Returns
+    -------
+    float
+        The remaining seconds, or None if there is no deadline.
+
+    Raises
+    ------
+    DeadlineExceededError
+        If the deadline has already passed.
+    """
+    if deadline is None:
+        return None
+    remaining = deadline - monotonic()
+    if remaining <= 0:
+        raise DeadlineExceededError("The request deadline has passed.")
+    return remaining
+
+
+def get_with_deadline(url: str, deadline: Optional[float] = None, **kwargs) -> requests.Response:
+    """
+    Send a GET request that may not run past the deadline.
+
+    The deadline applies to the whole request, including an upstream that sends its response
+    slowly. It is checked between socket operations, each of which is limited to the time remaining
+    when the request started, so the deadline can be overrun by at most one such operation. DNS
+    lookups are not limited.
+
+    Parameters
+    ----------
+    url: str
+        the URL to request
+    deadline: float
+        deadline on the time.monotonic() clock (output of get_deadline)
+    kwargs:
+        additional keyword arguments passed to requests.get
+
+    Returns
+    -------
+    requests.Response
+        The response.
+
+    Raises
+    ------
+    DeadlineExceededError
+        If the deadline passes before or during the request.
+    UpstreamError
+        If the request fails or the response has an error status.
+    """
+    timeout = get_remaining_time(deadline)
+    try:
+        response = requests.get(url, timeout=timeout, stream=deadline is not None, **kwargs)
+    except requests.Timeout as e:
+        raise DeadlineExceededError(f"The request to {url} did not finish in time.") from e
+    except requests.RequestException as e:
+        raise UpstreamError(f"The request to {url} failed: {e}") from e
+    if not response.ok:
+        response.close()
+        raise UpstreamError(f"The request to {url} failed with status {response.status_code}.")
+    if deadline is None:
+        return response
+
+    # read the body in chunks so a slow upstream cannot hold the request past the deadline
+    chunks = []
+    try:
+        for chunk in response.iter_content(chunk_size=8192):
+            chunks.append(chunk)
+            get_remaining_time(deadline)
+    except (DeadlineExceededError, requests.ConnectionError) as e:
+        response.close()
+        # requests reports a read timeout while streaming as a ConnectionError
+        if isinstance(e, requests.ConnectionError) and deadline > monotonic():
+            raise UpstreamError(f"The request to {url} failed: {e}") from e
+        raise DeadlineExceededError(f"The request to {url} did not finish in time.") from e
+    response._content = b"".join(chunks)
+    return response
+
+
+class RateLimiter:
+    """
+    Spaces out calls to an upstream API, across all threads that share the limiter.
+
+    Parameters
+    ----------
+    interval: float
+        minimum number of seconds between calls
+    """
+
+    def __init__(self, interval: float) -> None:
+        self.interval = interval
+        self._next_call = monotonic()
+        self._lock = Lock()
+
+    def wait(self, deadline: Optional[float] = None) -> None:
+        """
+        Wait for the next free slot to make a call, unless it comes after the deadline.
+
+        Parameters
+        ----------
+        deadline: float
+            deadline on the time.monotonic() clock (output of get_deadline)
+
+        Raises
+        ------
+        DeadlineExceededError
+            If the next free slot comes after the deadline. No slot is reserved in this case.
+        """
+        with self._lock:
+            now = monotonic()
+            slot = max(now, self._next_call)
+            if deadline is not None and slot >= deadline:
+                raise DeadlineExceededError("The request deadline would pass while waiting.")
+            self._next_call = slot + self.interval
+        sleep(slot - now)
@@ -4,10 +4,16 @@ Author: Hunter R. Merrill
 Description: This script contains utility functions for obtaining location data.
 """
 
-from typing import Any, Dict, Tuple
+import os
+from typing import Any, Dict, Optional, Tuple
 
 import numpy as np
-import requests
+from endurance_training_app.deadline_utils import get_with_deadline
+
+# can be overridden with the IPINFO_URL and CENSUS_GEOCODER_URL environment variables (e.g., for
+# load testing)
+IPINFO_URL = "https://ipinfo.io"
+CENSUS_GEOCODER_URL = "https://geocoding.geo.census.gov"
 
 
 def create_bounding_box(
@@ -41,19 +47,25 @@ def create_bounding_box(
     return min_lat, min_lon, max_lat, max_lon
 
 
-def get_location_from_ip() -> Dict[str, Any]:
+def get_location_from_ip(deadline: Optional[float] = None) -> Dict[str, Any]:
     """
     Get location information from IP address.
 
+    Parameters
+    ----------
+    deadline: float
+        deadline on the time.monotonic() clock for the request to finish by
+
     Returns
     -------
     Dict[str, Any]
     """
-    ip_response = requests.get("https://ipinfo.io/json")
+    base_url = os.environ.get("IPINFO_URL", IPINFO_URL)
+    ip_response = get_with_deadline(f"{base_url}/json", deadline=deadline)
     return ip_response.json()
 
 
-def get_fips_from_location(lon: float, lat: float) -> str:
+def get_fips_from_location(lon: float, lat: float, deadline: Optional[float] = None) -> str:
     """
     Get 5-digit FIPS code from latitude and longitude.
 
@@ -63,15 +75,18 @@ def get_fips_from_location(lon: float, lat: float) -> str:
         longitude in degrees
     lat: float
         latitude in degrees
+    deadline: float
+        deadline on the time.monotonic() clock for the request to finish by
 
     Returns
     -------
     str
         5-digit FIPS code; e.g., "01001".
     """
-    base_url = "https://geocoding.geo.census.gov/geocoder/geographies/coordinates"
+    base_url = os.environ.get("CENSUS_GEOCODER_URL", CENSUS_GEOCODER_URL)
+    base_url += "/geocoder/geographies/coordinates"
     params = f"?x={lon}&y={lat}&benchmark=4&vintage=423&format=json"
-    fips_response = requests.get(base_url + params).json()
+    fips_response = get_with_deadline(base_url + params, deadline=deadline).json()
     county_data = fips_response["result"]["geographies"]["Counties"][0]
     fips_code = str(county_data["STATE"]) + str(county_data["COUNTY"])
     return fips_code
@@ -7,15 +7,27 @@ PurpleAir API.
 
 import os
 from datetime import datetime, timedelta
-from time import sleep
 from typing import Any, Dict, List, Optional
 
-import requests
+from endurance_training_app.deadline_utils import (
+    DeadlineExceededError,
+    RateLimiter,
+    UpstreamError,
+    get_with_deadline,
+)
 from endurance_training_app.display_utils import get_color_from_aqi
 from endurance_training_app.location_utils import create_bounding_box, get_location_from_ip
 
+# can be overridden with the PURPLEAIR_API_URL environment variable (e.g., for load testing)
+PURPLEAIR_API_URL = "https://api.purpleair.com"
 
-def get_purpleair_sensor_data_in_box(lon: float, lat: float, limit: int = 5) -> List[Any]:
+# PurpleAir allows about one call per second; shared by all requests the server handles at once
+PURPLEAIR_RATE_LIMITER = RateLimiter(interval=1)
+
+
+def get_purpleair_sensor_data_in_box(
+    lon: float, lat: float, limit: int = 5, deadline: Optional[float] = None
+) -> List[Any]:
     """
     Get outdoor PurpleAir sensor IDs within a 5km bounding box with recent high confidence.
 
@@ -27,6 +39,8 @@ def get_purpleair_sensor_data_in_box(lon: float, lat: float, limit: int = 5) ->
         latitude in degrees
     limit: int
         The maximum number of sensors to return.
+    deadline: float
+        deadline on the time.monotonic() clock for the request to finish by
 
     Returns
     -------
@@ -34,7 +48,7 @@ def get_purpleair_sensor_data_in_box(lon: float, lat: float, limit: int = 5) ->
         The sensor IDs outdoors within the bounding box with recent high confidence values.
     """
     min_lat, min_lon, max_lat, max_lon = create_bounding_box(lon, lat, distance_km=5)
-    url = "https://api.purpleair.com/v1/sensors"
+    url = os.environ.get("PURPLEAIR_API_URL", PURPLEAIR_API_URL) + "/v1/sensors"
     headers = {"X-API-Key": os.environ.get("PURPLEAIR_API_KEY")}
     params = {
         "fields": "confidence",
@@ -45,7 +59,8 @@ def get_purpleair_sensor_data_in_box(lon: float, lat: float, limit: int = 5) ->
         "selat": min_lat,
         "selng": max_lon,
     }
-    purpleair_response = requests.get(url=url, params=params, headers=headers)
+    PURPLEAIR_RATE_LIMITER.wait(deadline=deadline)
+    purpleair_response = get_with_deadline(url, deadline=deadline, params=params, headers=headers)
     confident_sensors = [
         sensor[0] for sensor in purpleair_response.json()["data"] if sensor[1] >= 100
     ]
@@ -54,7 +69,9 @@ def get_purpleair_sensor_data_in_box(lon: float, lat: float, limit: int = 5) ->
     return confident_sensors
 
 
-def get_purpleair_sensor_history(sensor_ids: List[Any]) -> List[Dict[str, Any]]:
+def get_purpleair_sensor_history(
+    sensor_ids: List[Any], deadline: Optional[float] = None
+) -> List[Dict[str, Any]]:
     """
     Get PurpleAir sensor history for the last 3 hours from a given set of sensor IDs.
 
@@ -62,15 +79,25 @@ def get_purpleair_sensor_history(sensor_ids: List[Any]) -> List[Dict[str, Any]]:
     ----------
     sensor_ids: List
         List of sensor IDs
+    deadline: float
+        deadline on the time.monotonic() clock for all requests to finish by
 
     Returns
     -------
     List[Dict[str, Any]]
         A list of dictionaries containing sensor history.
+
+    Raises
+    ------
+    DeadlineExceededError
+        If the deadline passes before all sensors are fetched. The histories that did finish are
+        attached as `partial_result` and the sensor IDs that did not as `missing`.
+    UpstreamError
+        If some sensors failed (e.g., were rate limited), with the same attributes.
     """
     now = datetime.now()
     five_hours_ago = now - timedelta(hours=3)
-    url = "https://api.purpleair.com/v1/sensors/"
+    url = os.environ.get("PURPLEAIR_API_URL", PURPLEAIR_API_URL) + "/v1/sensors/"
     headers = {"X-API-Key": os.environ.get("PURPLEAIR_API_KEY")}
     params = {
         "fields": "pm2.5_atm",
@@ -79,15 +106,33 @@ def get_purpleair_sensor_history(sensor_ids: List[Any]) -> List[Dict[str, Any]]:
         "average": 10,  # seconds
     }
     results = []
-    for sensor_id in sensor_ids:
-        params.update({"sensor_index": int(sensor_id)})
-        purpleair_response = requests.get(
-            url=f"{url}{sensor_id}/history", params=params, headers=headers
-        )
+    failed_sensor_ids = []
+    for i, sensor_id in enumerate(sensor_ids):
+        try:
+            PURPLEAIR_RATE_LIMITER.wait(deadline=deadline)
+            params.update({"sensor_index": int(sensor_id)})
+            purpleair_response = get_with_deadline(
+                f"{url}{sensor_id}/history", deadline=deadline, params=params, headers=headers
+            )
+        except DeadlineExceededError as e:
+            raise DeadlineExceededError(
+                "PurpleAir sensor history did not finish in time.",
+                partial_result=results,
+                missing=failed_sensor_ids + sensor_ids[i:],
+            ) from e
+        except UpstreamError:
+            # report the sensor as missing and carry on with the rest
+            failed_sensor_ids.append(sensor_id)
+            continue
         result = purpleair_response.json()
         results.append(result)
-        sleep(1)
 
+    if failed_sensor_ids:
+        raise UpstreamError(
+            "PurpleAir sensor history failed for some sensors.",
+            partial_result=results,
+            missing=failed_sensor_ids,
+        )
     return results
 
 
@@ -160,7 +205,9 @@ def prepare_purpleair_history_for_chartjs(aqi_data: List[Dict[str, Any]]) -> Lis
     return prepared_data
 
 
-def get_purpleair_data(lat: Optional[float] = None, lon: Optional[float] = None) -> Dict[str, Any]:
+def get_purpleair_data(
+    lat: Optional[float] = None, lon: Optional[float] = None, deadline: Optional[float] = None
+) -> List[Dict[str, Any]]:
     """
     Get recent AQI data from the PurpleAir API.
 
@@ -170,19 +217,32 @@ def get_purpleair_data(lat: Optional[float] = None, lon: Optional[float] = None)
         latitude in degrees
     lon: float
         longitude in degrees
+    deadline: float
+        deadline on the time.monotonic() clock for all requests to finish by
 
     Returns
     -------
-    Dict[str, Any]
-        The AQI data from the PurpleAir API.
+    List[Dict[str, Any]]
+        The AQI data from the PurpleAir API, prepared for Chart.js.
+
+    Raises
+    ------
+    UpstreamError
+        If the deadline passes first (DeadlineExceededError) or a call fails. If some sensor
+        histories finished, they are attached (prepared for Chart.js) as `partial_result` and the
+        remaining sensor IDs as `missing`.
     """
     if lat is None or lon is None:
         # get the latitude and longitude from IP address
-        ip_data = get_location_from_ip()
+        ip_data = get_location_from_ip(deadline=deadline)
         lat, lon = ip_data["loc"].split(",")
 
-    sensor_ids = get_purpleair_sensor_data_in_box(lon=float(lon), lat=float(lat))
+    sensor_ids = get_purpleair_sensor_data_in_box(lon=float(lon), lat=float(lat), deadline=deadline)
 
     # get the sensor history for the last 24 hours
-    sensor_history = get_purpleair_sensor_history(sensor_ids=sensor_ids)
+    try:
+        sensor_history = get_purpleair_sensor_history(sensor_ids=sensor_ids, deadline=deadline)
+    except UpstreamError as e:
+        e.partial_result = prepare_purpleair_history_for_chartjs(e.partial_result)
+        raise
     return prepare_purpleair_history_for_chartjs(sensor_history)
@@ -0,0 +1,493 @@
+"""
+Author: Hunter R. Merrill
+
+Description: This script load tests the backend server without using real API quota. It starts
+local stand-ins for the AirNow, PurpleAir, ipinfo and Census geocoder APIs (with configurable
+latency, rate limits and error rates), points server.py at them, drives it with concurrent clients
+and reports throughput, latency percentiles and upstream calls per client request.
+"""
+
+import argparse
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import IO, Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import requests
+
+
+def get_fake_response(path: str) -> Optional[Any]:
+    """
+    Get a response imitating the upstream API that serves a given path.
+
+    Parameters
+    ----------
+    path: str
+        the request path, without the query string
+
+    Returns
+    -------
+    Any
+        The JSON-serializable response, or None if no upstream API serves the path.
+    """
+    if path.startswith("/aq/forecast/latLong"):
+        # AirNow forecast
+        today = datetime.today().strftime("%Y-%m-%d")
+        return [
+            {
+                "DateForecast": today,
+                "ParameterName": parameter,
+                "AQI": aqi,
+                "Category": {"Number": 1, "Name": "Good"},
+                "Discussion": "Today...\r\n\r\nTomorrow...\r\n\r\nThe day after...",
+            }
+            for parameter, aqi in [("O3", 42), ("PM2.5", 35)]
+        ]
+    if path.rstrip("/") == "/v1/sensors":
+        # PurpleAir sensors in a bounding box, as (sensor_index, confidence)
+        return {
+            "fields": ["sensor_index", "confidence"],
+            "data": [[1000 + i, 100] for i in range(8)],
+        }
+    if path.startswith("/v1/sensors/") and path.endswith("/history"):
+        # PurpleAir sensor history, as (time_stamp, pm2.5_atm) every 10 minutes
+        sensor_index = int(path.split("/")[3])
+        now = datetime.now()
+        return {
+            "sensor_index": sensor_index,
+            "fields": ["time_stamp", "pm2.5_atm"],
+            "data": [
+                [int((now - timedelta(minutes=10 * i)).timestamp()), random.uniform(2, 12)]
+                for i in range(18)
+            ],
+        }
+    if path == "/json":
+        # ipinfo
+        return {"ip": "127.0.0.1", "city": "Boulder", "loc": "40.0150,-105.2705"}
+    if path.startswith("/geocoder/geographies/coordinates"):
+        # Census geocoder
+        return {"result": {"geographies": {"Counties": [{"STATE": "08", "COUNTY": "013"}]}}}
+    return None
+
+
+class FakeUpstreamServer(ThreadingHTTPServer):
+    """
+    Local stand-in for an upstream API.
+
+    Parameters
+    ----------
+    latency: float
+        seconds to wait before each response
+    rate_limit: float
+        maximum requests per second before responding with 429. If None, there is no rate limit.
+    error_rate: float
+        fraction of requests to fail with 500
+    """
+
+    daemon_threads = True
+
+    def __init__(
+        self, latency: float = 0.0, rate_limit: Optional[float] = None, error_rate: float = 0.0
+    ) -> None:
+        super().__init__(("127.0.0.1", 0), FakeUpstreamHandler)
+        self.latency = latency
+        self.rate_limit = rate_limit
+        self.error_rate = error_rate
+        self.calls = 0
+        self.rate_limited = 0
+        self.errors = 0
+        self._recent_calls = deque()
+        self._lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        """The base URL of the server."""
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def record_call(self) -> int:
+        """
+        Count a call and decide how to respond to it.
+
+        Returns
+        -------
+        int
+            The HTTP status code to respond with.
+        """
+        with self._lock:
+            self.calls += 1
+            now = time.monotonic()
+            while self._recent_calls and self._recent_calls[0] <= now - 1:
+                self._recent_calls.popleft()
+            if self.rate_limit is not None and len(self._recent_calls) >= self.rate_limit:
+                self.rate_limited += 1
+                return 429
+            self._recent_calls.append(now)
+            if random.random() < self.error_rate:
+                self.errors += 1
+                return 500
+            return 200
+
+
+class FakeUpstreamHandler(BaseHTTPRequestHandler):
+    """Class for handling requests to a fake upstream API."""
+
+    def do_GET(self) -> None:
+        status = self.server.record_call()
+        time.sleep(self.server.latency)
+        path = urllib.parse.urlparse(self.path).path
+        data = get_fake_response(path)
+        if data is None:
+            status = 404
+        if status != 200:
+            # errors are reported the way the PurpleAir API reports them
+            data = {"error": self.responses[status][0], "description": f"Fake {status} response."}
+        self.send_response(status)
+        self.send_header("Content-type", "application/json")
+        self.end_headers()
+        self.wfile.write(json.dumps(data).encode("utf-8"))
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+
+def start_fake_upstream_servers(
+    latency: float = 0.0, rate_limit: Optional[float] = None, error_rate: float = 0.0
+) -> Dict[str, FakeUpstreamServer]:
+    """
+    Start a fake server for each upstream API in a background thread.
+
+    Parameters
+    ----------
+    latency: float
+        seconds each fake server waits before responding
+    rate_limit: float
+        maximum requests per second to each fake server. If None, there is no rate limit.
+    error_rate: float
+        fraction of requests to each fake server that fail with 500
+
+    Returns
+    -------
+    Dict[str, FakeUpstreamServer]
+        The servers, keyed by the environment variable that overrides the API's base URL.
+    """
+    servers = {}
+    for env_var in ["AIRNOW_API_URL", "PURPLEAIR_API_URL", "IPINFO_URL", "CENSUS_GEOCODER_URL"]:
+        server = FakeUpstreamServer(latency=latency, rate_limit=rate_limit, error_rate=error_rate)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers[env_var] = server
+    return servers
+
+
+def get_free_port() -> int:
+    """
+    Get a port that no other process is listening on.
+
+    Returns
+    -------
+    int
+        The port.
+    """
+    with socket.socket() as sock:
+        sock.bind(("localhost", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(
+    servers: Dict[str, FakeUpstreamServer], port: int, timeout: float, log_file: Optional[IO] = None
+) -> subprocess.Popen:
+    """
+    Start server.py in a subprocess, pointed at the fake upstream servers.
+
+    Parameters
+    ----------
+    servers: Dict[str, FakeUpstreamServer]
+        the fake upstream servers (output of start_fake_upstream_servers)
+    port: int
+        port on which to run server.py
+    timeout: float
+        default latency budget in seconds for each request to server.py
+    log_file: IO
+        file to write the output (including tracebacks) of server.py to. If None, the output goes to
+        this script's stderr.
+
+    Returns
+    -------
+    subprocess.Popen
+        The server process.
+    """
+    # make sure nothing else is listening on the port, or we would load test that instead
+    with socket.socket() as sock:
+        try:
+            sock.bind(("", port))
+        except OSError as e:
+            raise RuntimeError(f"Port {port} is already in use.") from e
+
+    env = dict(os.environ, **{env_var: server.url for env_var, server in servers.items()})
+    server_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "server.py")
+    process = subprocess.Popen(
+        [sys.executable, "-u", server_path, "--port", str(port), "--timeout", str(timeout)],
+        env=env,
+        stdout=log_file if log_file is not None else sys.stderr,
+        stderr=subprocess.STDOUT,
+    )
+
+    # wait for the server to accept connections, making sure it is our server that accepts them
+    for _ in range(100):
+        if process.poll() is not None:
+            raise RuntimeError(f"server.py exited with code {process.returncode} on port {port}.")
+        try:
+            socket.create_connection(("localhost", port), timeout=1).close()
+            return process
+        except OSError:
+            time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError(f"server.py did not start on port {port}.")
+
+
+def send_request(url: str, timeout: Optional[float] = None) -> Tuple[float, str]:
+    """
+    Send one client request to the server.
+
+    Parameters
+    ----------
+    url: str
+        the URL to request
+    timeout: float
+        seconds the client waits for the server. If None, it waits forever.
+
+    Returns
+    -------
+    Tuple[float, str]
+        The latency in seconds, and the outcome: "complete", "partial" (the server's deadline
+        passed) or "failed" (an error status, no response or a response that is not JSON).
+    """
+    start = time.monotonic()
+    try:
+        response = requests.get(url, timeout=timeout)
+        data = response.json()
+        if response.status_code != 200 or not isinstance(data, dict):
+            outcome = "failed"
+        elif data.get("partial", False):
+            outcome = "partial"
+        else:
+            outcome = "complete"
+    except (requests.RequestException, ValueError):
+        outcome = "failed"
+    return time.monotonic() - start, outcome
+
+
+def run_load_test(
+    url: str,
+    servers: Dict[str, FakeUpstreamServer],
+    clients: int = 10,
+    requests_per_client: int = 5,
+    client_timeout: Optional[float] = None,
+) -> Dict[str, Any]:
+    """
+    Drive the server with concurrent clients and summarize the results.
+
+    Parameters
+    ----------
+    url: str
+        the URL each client requests
+    servers: Dict[str, FakeUpstreamServer]
+        the fake upstream servers (output of start_fake_upstream_servers)
+    clients: int
+        number of concurrent clients
+    requests_per_client: int
+        number of requests each client sends, one after another
+    client_timeout: float
+        seconds each client waits for the server. If None, clients wait forever.
+
+    Returns
+    -------
+    Dict[str, Any]
+        Outcome counts, throughput, latency percentiles and upstream calls per client request.
+    """
+    calls_before = {env_var: server.calls for env_var, server in servers.items()}
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=clients) as executor:
+        results: List[Tuple[float, str]] = list(
+            executor.map(
+                lambda url: send_request(url, timeout=client_timeout),
+                [url] * (clients * requests_per_client),
+            )
+        )
+    elapsed = time.monotonic() - start
+
+    latencies = [latency for latency, _ in results]
+    outcomes = [outcome for _, outcome in results]
+    upstream_calls = {
+        env_var: server.calls - calls_before[env_var] for env_var, server in servers.items()
+    }
+    return {
+        "requests": len(results),
+        "complete": outcomes.count("complete"),
+        "partial": outcomes.count("partial"),
+        "failed": outcomes.count("failed"),
+        "throughput_rps": len(results) / elapsed,
+        "latency_p50_s": float(np.percentile(latencies, 50)),
+        "latency_p95_s": float(np.percentile(latencies, 95)),
+        "latency_p99_s": float(np.percentile(latencies, 99)),
+        "upstream_calls_per_request": {
+            env_var: calls / len(results) for env_var, calls in upstream_calls.items()
+        },
+        "upstream_rate_limited": sum(server.rate_limited for server in servers.values()),
+        "upstream_errors": sum(server.errors for server in servers.values()),
+    }
+
+
+def number_in_range(
+    cast: Callable[[str], Any], minimum: Any, maximum: Any = None, exclusive_minimum: bool = False
+) -> Callable[[str], Any]:
+    """
+    Make an argparse type for numbers within a range.
+
+    Parameters
+    ----------
+    cast: Callable
+        the numeric type; e.g., int or float
+    minimum: int or float
+        smallest allowed value
+    maximum: int or float
+        largest allowed value. If None, there is no maximum.
+    exclusive_minimum: bool
+        whether the minimum itself is not allowed
+
+    Returns
+    -------
+    Callable
+        A function that parses a command-line value.
+    """
+
+    def parse(value: str) -> Any:
+        try:
+            number = cast(value)
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"expected a number, got {value!r}")
+        too_small = number <= minimum if exclusive_minimum else number < minimum
+        # comparisons with NaN are always False, so check for it explicitly
+        if number != number or too_small or (maximum is not None and number > maximum):
+            bounds = f"{'>' if exclusive_minimum else '>='} {minimum}"
+            if maximum is not None:
+                bounds += f" and <= {maximum}"
+            raise argparse.ArgumentTypeError(f"expected a number {bounds}, got {value!r}")
+        return number
+
+    return parse
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test the server with fake upstream APIs.")
+    parser.add_argument(
+        "--clients",
+        type=number_in_range(int, 1),
+        default=10,
+        help="Concurrent clients (default: 10)",
+    )
+    parser.add_argument(
+        "--requests-per-client",
+        type=number_in_range(int, 1),
+        default=5,
+        help="Requests each client sends (default: 5)",
+    )
+    parser.add_argument(
+        "--subset",
+        choices=["aqi", "purpleair", "all"],
+        default="aqi",
+        help="Subset of data the clients request (default: aqi)",
+    )
+    parser.add_argument(
+        "--ip-location",
+        action="store_true",
+        help="Clients omit lat and lon, so the server looks up the location from the IP address",
+    )
+    parser.add_argument(
+        "--latency",
+        type=number_in_range(float, 0, maximum=3600),
+        default=0.1,
+        help="Seconds each fake upstream API waits before responding (default: 0.1)",
+    )
+    parser.add_argument(
+        "--rate-limit",
+        type=number_in_range(float, 0, exclusive_minimum=True),
+        default=None,
+        help="Requests per second each fake upstream API allows before responding with 429 "
+        "(default: no limit)",
+    )
+    parser.add_argument(
+        "--error-rate",
+        type=number_in_range(float, 0, maximum=1),
+        default=0.0,
+        help="Fraction of requests to each fake upstream API that fail with 500 (default: 0)",
+    )
+    parser.add_argument(
+        "--timeout",
+        type=number_in_range(float, 0, maximum=3600, exclusive_minimum=True),
+        default=30.0,
+        help="Latency budget in seconds passed to the server (default: 30)",
+    )
+    parser.add_argument(
+        "--client-timeout",
+        type=number_in_range(float, 0, maximum=3600, exclusive_minimum=True),
+        default=None,
+        help="Seconds each client waits for the server (default: the server's --timeout plus 10)",
+    )
+    parser.add_argument(
+        "--port",
+        type=number_in_range(int, 1, maximum=65535),
+        default=None,
+        help="Port on which to run the server (default: any free)",
+    )
+    parser.add_argument(
+        "--server-log",
+        default=None,
+        help="File to write the server's output (including tracebacks) to (default: a new "
+        "temporary file)",
+    )
+    args = parser.parse_args()
+
+    if args.server_log is None:
+        fd, args.server_log = tempfile.mkstemp(prefix="load_test_server_", suffix=".log")
+        os.close(fd)
+    log_file = open(args.server_log, "w")
+
+    servers = start_fake_upstream_servers(
+        latency=args.latency, rate_limit=args.rate_limit, error_rate=args.error_rate
+    )
+    port = args.port if args.port is not None else get_free_port()
+    process = start_server(servers, port=port, timeout=args.timeout, log_file=log_file)
+    try:
+        params = {} if args.ip_location else {"lat": 40.0150, "lon": -105.2705}
+        if args.subset != "all":
+            params["subset"] = args.subset
+        url = f"http://localhost:{port}/?{urllib.parse.urlencode(params)}"
+        client_timeout = args.client_timeout
+        if client_timeout is None:
+            client_timeout = args.timeout + 10
+        results = run_load_test(
+            url,
+            servers,
+            clients=args.clients,
+            requests_per_client=args.requests_per_client,
+            client_timeout=client_timeout,
+        )
+        print(json.dumps(results, indent=2))
+    finally:
+        process.terminate()
+        process.wait()
+        log_file.close()
+        print(f"Server log: {args.server_log}", file=sys.stderr)
@@ -1,15 +1,30 @@
 import argparse
+import gzip
 import json
+import math
+import os
+import tempfile
+import time
 import urllib.parse
-from http.server import BaseHTTPRequestHandler, HTTPServer
-from typing import Any, Dict, Optional
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
 
 import numpy as np
-from endurance_training_app import calculate_tipping_point, get_aqi_data, get_purpleair_data
+from endurance_training_app import (
+    UpstreamError,
+    calculate_tipping_point,
+    get_aqi_data,
+    get_deadline,
+    get_purpleair_data,
+)
 
 
 def get_all_data(
-    lat: Optional[float] = None, lon: Optional[float] = None, subset: Optional[str] = None
+    lat: Optional[float] = None,
+    lon: Optional[float] = None,
+    subset: Optional[str] = None,
+    deadline: Optional[float] = None,
 ) -> Dict[str, Any]:
     """
     Get all data from the current location for the web app.
@@ -21,29 +36,46 @@ def get_all_data(
     lon: float
         longitude in degrees
     subset: str
-        subset of data to return
+        subset of data to return: "aqi" or "purpleair". Anything else returns both.
+    deadline: float
+        deadline on the time.monotonic() clock for all upstream calls to finish by
 
     Returns
     -------
     Dict[str, Any]
-        The AirNow and/or PurpleAir data for the current location.
+        The AirNow and/or PurpleAir data for the current location. If the deadline passed or an
+        upstream call failed, "partial" is True and "missing" lists the providers and PurpleAir
+        sensors that did not finish. The key of a provider that did not finish at all is absent.
     """
     data = {}
-    if subset == "aqi":
-        data["aqi"] = get_aqi_data(lon=lon, lat=lat)
-        aqi = data["aqi"]["AQI"]
-    elif subset == "purpleair":
-        data["purpleair"] = get_purpleair_data(lon=lon, lat=lat)
-        aqi = np.mean([np.mean([x["y"] for x in d["data"]]) for d in data["purpleair"]])
-    else:
-        data["aqi"] = get_aqi_data(lon=lon, lat=lat)
-        data["purpleair"] = get_purpleair_data(lon=lon, lat=lat)
+    missing = {"providers": [], "purpleair_sensors": []}
+    aqi_values = []
+    if subset != "purpleair":
+        try:
+            data["aqi"] = get_aqi_data(lon=lon, lat=lat, deadline=deadline)
+            aqi_values.append(data["aqi"]["AQI"])
+        except UpstreamError:
+            missing["providers"].append("aqi")
 
-        # use the maximum of the AirNow forecast and the average purpleair data to find tipping points
-        purpleair_avg_aqi = np.mean(
-            [np.mean([x["y"] for x in d["data"]]) for d in data["purpleair"]]
-        )
-        aqi = max([data["aqi"]["AQI"], purpleair_avg_aqi])
+    if subset != "aqi":
+        try:
+            data["purpleair"] = get_purpleair_data(lon=lon, lat=lat, deadline=deadline)
+        except UpstreamError as e:
+            if e.partial_result is None:
+                missing["providers"].append("purpleair")
+            else:
+                data["purpleair"] = e.partial_result
+            missing["purpleair_sensors"] = e.missing
+        if data.get("purpleair"):
+            aqi_values.append(
+                np.mean([np.mean([x["y"] for x in d["data"]]) for d in data["purpleair"]])
+            )
+
+    # use the maximum of the AirNow forecast and the average purpleair data to find tipping points
+    aqi = max(aqi_values) if aqi_values else None
+
+    data["partial"] = bool(missing["providers"] or missing["purpleair_sensors"])
+    data["missing"] = missing
 
     if aqi is not None:
         data["tipping_points"] = {}
@@ -59,27 +91,248 @@ def get_all_data(
 class RequestHandler(BaseHTTPRequestHandler):
     """Class for handling requests."""
 
+    # latency budget in seconds, used when a request has no "timeout" query parameter. A request
+    # may ask for a shorter budget, but not a longer one.
+    default_timeout: Optional[float] = 30.0
+
+    def send_json(self, data: Dict[str, Any], status: int = 200) -> None:
+        """
+        Respond with JSON.
+
+        Parameters
+        ----------
+        data: Dict[str, Any]
+            the response body
+        status: int
+            HTTP status code
+        """
+        self.send_response(status)
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.send_header("Content-type", "application/json")
+        self.end_headers()
+        self.wfile.write(json.dumps(data).encode("utf-8"))
+
     def do_GET(self) -> None:
         lon, lat = None, None
         parsed_url = urllib.parse.urlparse(self.path)
         query_params = urllib.parse.parse_qs(parsed_url.query)
         if "lon" in query_params and "lat" in query_params:
-            lon = float(query_params["lon"][0])
-            lat = float(query_params["lat"][0])
+            try:
+                lon = float(query_params["lon"][0])
+                lat = float(query_params["lat"][0])
+            except ValueError:
+                self.send_json({"error": "lat and lon must be numbers."}, status=400)
+                return
         if "subset" in query_params:
             subset = query_params["subset"][0]
         else:
             subset = None
+        timeout = self.default_timeout
+        if "timeout" in query_params:
+            try:
+                timeout = float(query_params["timeout"][0])
+            except ValueError:
+                timeout = math.nan
+            if not math.isfinite(timeout) or timeout <= 0:
+                self.send_json(
+                    {"error": "timeout must be a positive number of seconds."}, status=400
+                )
+                return
+            if self.default_timeout is not None:
+                timeout = min(timeout, self.default_timeout)
+        deadline = get_deadline(timeout)
 
-        self.send_response(200)
-        self.send_header("Access-Control-Allow-Origin", "*")
-        self.send_header("Content-type", "application/json")
-        self.end_headers()
-        data = get_all_data(lon=lon, lat=lat, subset=subset)
-        self.wfile.write(json.dumps(data).encode("utf-8"))
+        # get the data before sending any headers, so a failure can still be reported to the client
+        try:
+            data = get_all_data(lon=lon, lat=lat, subset=subset, deadline=deadline)
+        except Exception as e:
+            self.log_error("Failed to get data: %r", e)
+            self.send_json({"error": "Failed to get data from upstream APIs."}, status=502)
+            return
+        self.send_json(data)
+
+
+def write_files_atomically(files: Dict[str, bytes]) -> None:
+    """
+    Write files so that readers (e.g., Apache) never see them partially written or out of sync.
+
+    The content of every file is first written to a temporary file in the same directory. Only once
+    all of them are written do they replace their targets, each in a single rename. Both the files
+    and the renames are synced to disk, so a power loss cannot leave an empty file behind.
+
+    Parameters
+    ----------
+    files: Dict[str, bytes]
+        content of each file, keyed by the path to write it to
+    """
+    tmp_paths = {}
+    try:
+        for path, content in files.items():
+            directory = os.path.dirname(path) or "."
+            fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".", suffix=".tmp")
+            tmp_paths[path] = tmp_path
+            with os.fdopen(fd, "wb") as f:
+                f.write(content)
+                f.flush()
+                os.fsync(f.fileno())
+            # mkstemp creates files readable only by the owner; the web server must read them
+            os.chmod(tmp_path, 0o644)
+    except BaseException:
+        for tmp_path in tmp_paths.values():
+            os.remove(tmp_path)
+        raise
+
+    for path, tmp_path in tmp_paths.items():
+        os.replace(tmp_path, path)
+
+    # sync the directories so the renames themselves survive a power loss
+    for directory in {os.path.dirname(path) or "." for path in files}:
+        dir_fd = os.open(directory, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+
+def write_snapshot(path: str, data: Dict[str, Any]) -> None:
+    """
+    Write a JSON snapshot along with a pre-compressed `.gz` sibling.
+
+    Parameters
+    ----------
+    path: str
+        path of the JSON file to write
+    data: Dict[str, Any]
+        the data to write (output of get_all_data)
+    """
+    content = json.dumps(data).encode("utf-8")
+    write_files_atomically({path: content, path + ".gz": gzip.compress(content, mtime=0)})
+
+
+def export_snapshots(
+    export_dir: str,
+    locations: Dict[str, Tuple[Optional[float], Optional[float]]],
+    subsets: List[Optional[str]],
+    timeout: Optional[float] = 30.0,
+) -> None:
+    """
+    Write the output of get_all_data for each location and subset to a directory.
+
+    Snapshots are written to `<export_dir>/<location name>/<subset>.json` (`all.json` if the subset
+    is None), with the time they were generated in "generated_at" (ISO 8601, UTC). A partial result
+    does not replace an existing snapshot.
+
+    Parameters
+    ----------
+    export_dir: str
+        directory in which to write the snapshots
+    locations: Dict[str, Tuple[float, float]]
+        (latitude, longitude) in degrees keyed by location name. (None, None) uses the IP address.
+    subsets: List[str]
+        subsets of data to export
+    timeout: float
+        latency budget in seconds for each snapshot. If None, there is no deadline.
+    """
+    for name, (lat, lon) in locations.items():
+        location_dir = os.path.join(export_dir, name)
+        os.makedirs(location_dir, exist_ok=True)
+        for subset in subsets:
+            path = os.path.join(location_dir, f"{subset or 'all'}.json")
+            try:
+                data = get_all_data(lat=lat, lon=lon, subset=subset, deadline=get_deadline(timeout))
+            except Exception as e:
+                # keep the previous snapshot and move on to the next one
+                print(f"Failed to export {path}: {e!r}")
+                continue
+            if data["partial"] and os.path.exists(path):
+                print(f"Keeping previous {path}; missing {data['missing']}")
+                continue
+            data["generated_at"] = datetime.now(timezone.utc).isoformat(timespec="seconds")
+            write_snapshot(path, data)
 
 
-def run(handler_class: BaseHTTPRequestHandler = RequestHandler, port: int = 8081) -> None:
+def run_export(
+    export_dir: str,
+    locations: Dict[str, Tuple[Optional[float], Optional[float]]],
+    subsets: List[Optional[str]],
+    timeout: Optional[float] = 30.0,
+    interval: Optional[float] = 600.0,
+) -> None:
+    """
+    Periodically export snapshots for a web server (e.g., Apache) to serve statically.
+
+    Parameters
+    ----------
+    export_dir: str
+        directory in which to write the snapshots
+    locations: Dict[str, Tuple[float, float]]
+        (latitude, longitude) in degrees keyed by location name. (None, None) uses the IP address.
+    subsets: List[str]
+        subsets of data to export
+    timeout: float
+        latency budget in seconds for each snapshot. If None, there is no deadline.
+    interval: float
+        seconds between exports. If None, export once and return.
+    """
+    print(f"Exporting snapshots to {export_dir}...")
+    while True:
+        start = time.monotonic()
+        export_snapshots(export_dir, locations=locations, subsets=subsets, timeout=timeout)
+        if interval is None:
+            return
+        time.sleep(max(0.0, interval - (time.monotonic() - start)))
+
+
+def positive_float(value: str) -> float:
+    """
+    Parse a positive number given on the command line.
+
+    Parameters
+    ----------
+    value: str
+        the number
+
+    Returns
+    -------
+    float
+        The number.
+    """
+    try:
+        number = float(value)
+    except ValueError:
+        number = math.nan
+    if not math.isfinite(number) or number <= 0:
+        raise argparse.ArgumentTypeError(f"expected a positive number, got {value!r}")
+    return number
+
+
+def parse_location(location: str) -> Tuple[str, Tuple[float, float]]:
+    """
+    Parse a location given on the command line as NAME=LAT,LON.
+
+    Parameters
+    ----------
+    location: str
+        the location; e.g., "home=40.01,-105.27"
+
+    Returns
+    -------
+    Tuple[str, Tuple[float, float]]
+        The location name and its (latitude, longitude) in degrees.
+    """
+    try:
+        name, coordinates = location.split("=")
+        lat, lon = coordinates.split(",")
+        return name, (float(lat), float(lon))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected NAME=LAT,LON, got {location!r}")
+
+
+def run(
+    handler_class: BaseHTTPRequestHandler = RequestHandler,
+    port: int = 8081,
+    timeout: Optional[float] = 30.0,
+) -> None:
     """
     Run the server.
 
@@ -89,9 +342,14 @@ def run(handler_class: BaseHTTPRequestHandler = RequestHandler, port: int = 8081
         handler class
     port: int
         port
+    timeout: float
+        default latency budget in seconds for each request. If None, requests have no deadline.
     """
+    handler_class.default_timeout = timeout
     server_address = ("", port)
-    httpd = HTTPServer(server_address, handler_class)
+    # handle each request in its own thread, so time spent waiting for other requests does not count
+    # against a request's latency budget
+    httpd = ThreadingHTTPServer(server_address, handler_class)
     print(f"Starting server on port {port}...")
     httpd.serve_forever()
 
@@ -104,5 +362,52 @@ if __name__ == "__main__":
         default=8081,
         help="Port on which to run the server (default: 8081)",
     )
+    parser.add_argument(
+        "--timeout",
+        type=positive_float,
+        default=30.0,
+        help="Default latency budget in seconds for each request (default: 30). A request can "
+        "override it with the 'timeout' query parameter.",
+    )
+    parser.add_argument(
+        "--export-dir",
+        help="Instead of running the server, periodically write JSON snapshots to this directory "
+        "for a web server (e.g., Apache) to serve statically.",
+    )
+    parser.add_argument(
+        "--location",
+        type=parse_location,
+        action="append",
+        help="Location to export as NAME=LAT,LON; may be repeated (default: the location of this "
+        "machine's IP address, exported as 'default').",
+    )
+    parser.add_argument(
+        "--subset",
+        choices=["aqi", "purpleair", "all"],
+        action="append",
+        help="Subset of data to export; may be repeated (default: aqi and purpleair).",
+    )
+    parser.add_argument(
+        "--interval",
+        type=positive_float,
+        default=600.0,
+        help="Seconds between exports (default: 600).",
+    )
+    parser.add_argument(
+        "--once",
+        action="store_true",
+        help="Export once and exit (e.g., when run from cron).",
+    )
     args = parser.parse_args()
-    run(port=args.port)
+    if args.export_dir is not None:
+        locations = dict(args.location) if args.location else {"default": (None, None)}
+        subsets = [None if s == "all" else s for s in args.subset or ["aqi", "purpleair"]]
+        run_export(
+            args.export_dir,
+            locations=locations,
+            subsets=subsets,
+            timeout=args.timeout,
+            interval=None if args.once else args.interval,
+        )
+    else:
+        run(port=args.port, timeout=args.timeout)
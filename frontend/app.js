@@ -339,11 +339,36 @@ function loadWeather(latitude, longitude) {
         });
 }
 
+// Describe when a snapshot was generated, if it is out of date (see `server.py --export-dir`)
+function getSnapshotAgeText(data) {
+    if (!data.generated_at) {
+        return "";
+    }
+    const generatedAt = new Date(data.generated_at);
+    if (Date.now() - generatedAt.getTime() < snapshotMaxAgeMinutes * 60 * 1000) {
+        return "";
+    }
+    return ` (as of ${generatedAt.toLocaleString()})`;
+}
+
 // Loading PurpleAir is a bit slower (PurpleAir History API is rate-limited)
 async function loadPurpleair(url) {
     fetch(url)
         .then(response => response.json())
         .then(data => {
+            purpleairPill = document.getElementById("purpleair-pill");
+
+            // the server leaves out PurpleAir data that did not arrive in time
+            if (!data.purpleair || data.purpleair.length === 0) {
+                purpleairPill.textContent = "PurpleAir data unavailable";
+                return;
+            }
+            let chartTitle = "PurpleAir monitors near you-- last five hours";
+            if (data.partial && data.missing.purpleair_sensors.length > 0) {
+                chartTitle += ` (${data.missing.purpleair_sensors.length} unavailable)`;
+            }
+            chartTitle += getSnapshotAgeText(data);
+
             Chart.defaults.font.family = "Arial";
 
             // Display PurpleAir data on the AQI widget
@@ -370,7 +395,7 @@ async function loadPurpleair(url) {
                         x: {
                             title: {
                                 display: true,
-                                text: 'PurpleAir monitors near you-- last five hours',
+                                text: chartTitle,
                             },
                             ticks: {
                                 callback: function (val, index) {
@@ -385,7 +410,6 @@ async function loadPurpleair(url) {
                     }
                 }
             });
-            purpleairPill = document.getElementById("purpleair-pill");
             purpleairPill.style.display = "none";
         })
         .catch(error => {
@@ -402,36 +426,48 @@ function loadAQI(url) {
 
             // Populate AQI widget
             aqiPill = document.getElementById("aqi-pill");
-            aqiPill.style.background = data.aqi.pill_color_hex;
-            aqiPill.style.color = data.aqi.text_color_hex;
-            aqiPill.textContent = `${data.aqi.AQI} - ${data.aqi.Category.Name}`;
-            aqiPill.addEventListener('click', function () {
-                const aqiText = document.getElementById("aqi-description");
-                const aqiDiscussion = document.getElementById("aqi-discussion");
-                if (aqiText.style.display === "none") {
-                    aqiText.style.display = "block";
-                    aqiText.style.fontSize = "12px";
-                    aqiText.style.color = "rgb(100, 100, 100)";
-
-                    aqiDiscussion.style.display = "block";
-                    aqiDiscussion.style.fontSize = "14px";
-                    aqiDiscussion.style.color = "rgb(0, 0, 0)";
-                    aqiDiscussion.style.whiteSpace = "pre-wrap";
-                    aqiDiscussion.textContent = data.aqi.Discussion;
-
-                    purpleairPill.style.display = "inline-block";
-                } else {
-                    aqiText.style.display = "none";
-                    aqiDiscussion.style.display = "none";
-                    purpleairPill.style.display = "none";
-                }
-            });
+            if (!data.aqi) {
+                // the server leaves out AirNow data that did not arrive in time
+                aqiPill.style.background = "#d3d3d3";
+                aqiPill.textContent = "AirNow data unavailable";
+                purpleairPill.style.display = "inline-block";
+            } else {
+                aqiPill.style.background = data.aqi.pill_color_hex;
+                aqiPill.style.color = data.aqi.text_color_hex;
+                aqiPill.textContent = `${data.aqi.AQI} - ${data.aqi.Category.Name}${getSnapshotAgeText(data)}`;
+                aqiPill.addEventListener('click', function () {
+                    const aqiText = document.getElementById("aqi-description");
+                    const aqiDiscussion = document.getElementById("aqi-discussion");
+                    if (aqiText.style.display === "none") {
+                        aqiText.style.display = "block";
+                        aqiText.style.fontSize = "12px";
+                        aqiText.style.color = "rgb(100, 100, 100)";
+
+                        aqiDiscussion.style.display = "block";
+                        aqiDiscussion.style.fontSize = "14px";
+                        aqiDiscussion.style.color = "rgb(0, 0, 0)";
+                        aqiDiscussion.style.whiteSpace = "pre-wrap";
+                        aqiDiscussion.textContent = data.aqi.Discussion;
+
+                        purpleairPill.style.display = "inline-block";
+                    } else {
+                        aqiText.style.display = "none";
+                        aqiDiscussion.style.display = "none";
+                        purpleairPill.style.display = "none";
+                    }
+                });
+            }
 
             purpleairPill.addEventListener('click', function () {
-                const urlElements = url.split("&");
-                const urlSubset = urlElements.pop();
-                const urlNoSubset = urlElements.join("&");
-                const urlPurpleair = `${urlNoSubset}&subset=purpleair`;
+                let urlPurpleair;
+                if (snapshotDir) {
+                    urlPurpleair = `${snapshotDir}/purpleair.json`;
+                } else {
+                    const urlElements = url.split("&");
+                    const urlSubset = urlElements.pop();
+                    const urlNoSubset = urlElements.join("&");
+                    urlPurpleair = `${urlNoSubset}&subset=purpleair`;
+                }
                 purpleairPill.textContent = "Loading PurpleAir data...";
                 loadPurpleair(urlPurpleair);
             });
@@ -439,16 +475,21 @@ function loadAQI(url) {
             tippingPointRun = document.getElementById("tipping-point-pill-run");
             tippingPointBike = document.getElementById("tipping-point-pill-bike");
             tippingPointWalk = document.getElementById("tipping-point-pill-walk");
+            const tippingPoints = data.tipping_points || {
+                running: "N/A",
+                cycling: "N/A",
+                walking: "N/A",
+            };
 
             tippingPointRun.innerHTML = `<svg xmlns="http://www.w3.org/2000/svg" width="6" height="6" fill="currentColor" class="icon" viewBox="0 0 448 512">
                             <path d="M320 48a48 48 0 1 0 -96 0 48 48 0 1 0 96 0zM125.7 175.5c9.9-9.9 23.4-15.5 37.5-15.5c1.9 0 3.8 .1 5.6 .3L137.6 254c-9.3 28 1.7 58.8 26.8 74.5l86.2 53.9-25.4 88.8c-4.9 17 5 34.7 22 39.6s34.7-5 39.6-22l28.7-100.4c5.9-20.6-2.6-42.6-20.7-53.9L238 299l30.9-82.4 5.1 12.3C289 264.7 323.9 288 362.7 288l21.3 0c17.7 0 32-14.3 32-32s-14.3-32-32-32l-21.3 0c-12.9 0-24.6-7.8-29.5-19.7l-6.3-15c-14.6-35.1-44.1-61.9-80.5-73.1l-48.7-15c-11.1-3.4-22.7-5.2-34.4-5.2c-31 0-60.8 12.3-82.7 34.3L57.4 153.4c-12.5 12.5-12.5 32.8 0 45.3s32.8 12.5 45.3 0l23.1-23.1zM91.2 352L32 352c-17.7 0-32 14.3-32 32s14.3 32 32 32l69.6 0c19 0 36.2-11.2 43.9-28.5L157 361.6l-9.5-6c-17.5-10.9-30.5-26.8-37.9-44.9L91.2 352z"/>
-                        </svg> ${data.tipping_points.running}`;
+                        </svg> ${tippingPoints.running}`;
             tippingPointBike.innerHTML = `<svg xmlns="http://www.w3.org/2000/svg" width="6" height="6" fill="currentColor" class="icon" viewBox="0 0 640 512">
                             <path d="M400 96a48 48 0 1 0 0-96 48 48 0 1 0 0 96zm27.2 64l-61.8-48.8c-17.3-13.6-41.7-13.8-59.1-.3l-83.1 64.2c-30.7 23.8-28.5 70.8 4.3 91.6L288 305.1 288 416c0 17.7 14.3 32 32 32s32-14.3 32-32l0-128c0-10.7-5.3-20.7-14.2-26.6L295 232.9l60.3-48.5L396 217c5.7 4.5 12.7 7 20 7l64 0c17.7 0 32-14.3 32-32s-14.3-32-32-32l-52.8 0zM56 384a72 72 0 1 1 144 0A72 72 0 1 1 56 384zm200 0A128 128 0 1 0 0 384a128 128 0 1 0 256 0zm184 0a72 72 0 1 1 144 0 72 72 0 1 1 -144 0zm200 0a128 128 0 1 0 -256 0 128 128 0 1 0 256 0z"/>                      
-                        </svg> ${data.tipping_points.cycling}`;
+                        </svg> ${tippingPoints.cycling}`;
             tippingPointWalk.innerHTML = `<svg xmlns="http://www.w3.org/2000/svg" width="6" height="6" fill="currentColor" class="icon" viewBox="0 0 448 512">
                             <path d="M160 48a48 48 0 1 1 96 0 48 48 0 1 1 -96 0zM126.5 199.3c-1 .4-1.9 .8-2.9 1.2l-8 3.5c-16.4 7.3-29 21.2-34.7 38.2l-2.6 7.8c-5.6 16.8-23.7 25.8-40.5 20.2s-25.8-23.7-20.2-40.5l2.6-7.8c11.4-34.1 36.6-61.9 69.4-76.5l8-3.5c20.8-9.2 43.3-14 66.1-14c44.6 0 84.8 26.8 101.9 67.9L281 232.7l21.4 10.7c15.8 7.9 22.2 27.1 14.3 42.9s-27.1 22.2-42.9 14.3L247 287.3c-10.3-5.2-18.4-13.8-22.8-24.5l-9.6-23-19.3 65.5 49.5 54c5.4 5.9 9.2 13 11.2 20.8l23 92.1c4.3 17.1-6.1 34.5-23.3 38.8s-34.5-6.1-38.8-23.3l-22-88.1-70.7-77.1c-14.8-16.1-20.3-38.6-14.7-59.7l16.9-63.5zM68.7 398l25-62.4c2.1 3 4.5 5.8 7 8.6l40.7 44.4-14.5 36.2c-2.4 6-6 11.5-10.6 16.1L54.6 502.6c-12.5 12.5-32.8 12.5-45.3 0s-12.5-32.8 0-45.3L68.7 398z"/>
-                      </svg> ${data.tipping_points.walking}`;
+                      </svg> ${tippingPoints.walking}`;
 
             // when clicking, cycle through tipping points and show text
             const pills = document.querySelectorAll('.pill-tab');
@@ -493,6 +534,12 @@ function loadAQI(url) {
         });
 }
 
+// to load snapshots written by `server.py --export-dir` instead of querying the server, set this to
+// the snapshot directory for a location, relative to this page; e.g., "snapshots/default"
+const snapshotDir = null;
+// snapshots older than this show the time they were generated
+const snapshotMaxAgeMinutes = 30;
+
 // determine whether to fetch from localhost, raspberrypi, or AWS
 let url;
 let port = "";
@@ -514,12 +561,22 @@ if (hostname === "raspberrypi.local") {
     port = ":8081";
 }
 
+function getAqiUrl(lat, lon) {
+    if (snapshotDir) {
+        return `${snapshotDir}/aqi.json`;
+    }
+    if (lat === undefined || lon === undefined) {
+        return `${transferProtocol}//${url}${port}?subset=aqi`;
+    }
+    return `${transferProtocol}//${url}${port}/?lat=${lat}&lon=${lon}&subset=aqi`;
+}
+
 // We will try to get a more precise location from the browser
 async function locSuccessCallback(position) {
     const lat = position.coords.latitude;
     const lon = position.coords.longitude;
     loadWeather(lat, lon);
-    loadAQI(`${transferProtocol}//${url}${port}/?lat=${lat}&lon=${lon}&subset=aqi`);
+    loadAQI(getAqiUrl(lat, lon));
 }
 
 function locErrorCallback(position) {
@@ -529,7 +586,7 @@ function locErrorCallback(position) {
             const lat = data.loc.split(",")[0];
             const lon = data.loc.split(",")[1];
             loadWeather(lat, lon);
-            loadAQI(`${transferProtocol}//${url}${port}/?lat=${lat}&lon=${lon}&subset=aqi`);
+            loadAQI(getAqiUrl(lat, lon));
         })
         .catch(error => {
             console.error("Error fetching data:", error);
@@ -550,6 +607,6 @@ document.addEventListener("DOMContentLoaded", () => {
             .catch(error => {
                 console.error("Error fetching data:", error);
             });
-        loadAQI(`${transferProtocol}//${url}${port}?subset=aqi`);
+        loadAQI(getAqiUrl());
     }
 });